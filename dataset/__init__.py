@@ -1,5 +1,5 @@
 import torch
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, DistributedSampler
 from pathlib2 import Path, Iterable
 from typing import Union, Iterable
 import pandas as pd
@@ -64,18 +64,27 @@ class ImageDataset(Dataset):
 		return image, param, prop
 	
 
-def create_dataset(batch_size, datafilepath, **kwargs):
+def create_dataset(batch_size, datafilepath, distributed=False, **kwargs):
 	path = Path.cwd()
 	df= pd.read_pickle(f"{datafilepath}")
 	
 	dataset = ImageDataset(df)
 	dataset.preprocessing()
 	
+	num_workers = kwargs.get("num_workers", 4)
 	loader_params = dict(
 		shuffle=kwargs.get("shuffle", True),
 		drop_last=kwargs.get("drop_last", True),
 		pin_memory=kwargs.get("pin_memory", True),
-		num_workers=kwargs.get("num_workers", 4),
+		num_workers=num_workers,
 	)
+	if num_workers > 0:
+		# keep workers alive across epochs and batches queued ahead of the GPU
+		loader_params["persistent_workers"] = kwargs.get("persistent_workers", False)
+		loader_params["prefetch_factor"] = kwargs.get("prefetch_factor", 2)
+	if distributed:
+		# each rank sees its own shard, the sampler takes over shuffling
+		loader_params["sampler"] = DistributedSampler(
+			dataset, shuffle=loader_params.pop("shuffle"), drop_last=loader_params["drop_last"])
 	dataloader = DataLoader(dataset, batch_size=batch_size, **loader_params)
 	return dataloader, dataset.params_scaler, dataset.prop_scaler
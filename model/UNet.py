@@ -9,19 +9,14 @@ from abc import ABC, abstractmethod
 # -------------------------
 # Helpers
 # -------------------------
-def timestep_embedding(timesteps, dim, max_period=10000):
+def timestep_frequencies(dim, max_period=10000):
     """
-    Sinusoidal timestep embeddings.
+    Frequencies of the sinusoidal timestep embedding.
     """
     half = dim // 2
-    freqs = torch.exp(
+    return torch.exp(
         -math.log(max_period) * torch.arange(start=0, end=half, dtype=torch.float32) / half
-    ).to(device=timesteps.device)
-    args = timesteps[:, None].float() * freqs[None]
-    embedding = torch.cat([torch.cos(args), torch.sin(args)], dim=-1)
-    if dim % 2:
-        embedding = torch.cat([embedding, torch.zeros_like(embedding[:, :1])], dim=-1)
-    return embedding
+    )
 
 # TimestepBlock interface
 class TimestepBlock(nn.Module):
@@ -36,36 +31,41 @@ def norm_layer(channels):
     return nn.GroupNorm(32, channels)
 
 # -------------------------
-# Residual / Upsample / Downsample blocks
+# Residual / Upsample blocks
 # -------------------------
 class ResidualBlock(TimestepBlock):
-	def __init__(self, in_channels, out_channels, time_channels, dropout, residual_scale=1.0):
+	"""
+	Residual block with timestep embedding. With down=True conv1 and the shortcut
+	use stride 2, so the block also halves the resolution in place of a Downsample.
+	Downsampling in the UNet always goes through this path; conv_resample only
+	selects learned (transposed conv) vs nearest-neighbour upsampling.
+	"""
+	def __init__(self, in_channels, out_channels, time_channels, dropout, residual_scale=1.0, down=False):
 		super().__init__()
 		self.residual_scale = residual_scale
-		self.conv1 = nn.Sequential(
-			norm_layer(in_channels),
-			nn.SiLU(),
-			nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1)
-		)
+		stride = 2 if down else 1
+		# explicit layers (no nn.Sequential) so the time embedding add becomes the
+		# epilogue of conv1 and fuses with the following norm/activation
+		self.norm1 = norm_layer(in_channels)
+		self.conv1 = nn.Conv2d(in_channels, out_channels, kernel_size=3, stride=stride, padding=1)
 		self.time_emb = nn.Sequential(
 			nn.SiLU(),
 			nn.Linear(time_channels, out_channels)
 		)
-		self.conv2 = nn.Sequential(
-			norm_layer(out_channels),
-			nn.SiLU(),
-			nn.Dropout(p=dropout),
-			nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1)
-		)
+		self.norm2 = norm_layer(out_channels)
+		self.dropout = nn.Dropout(p=dropout)
+		self.conv2 = nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1)
 		if in_channels != out_channels:
-			self.shortcut = nn.Conv2d(in_channels, out_channels, kernel_size=1)
+			self.shortcut = nn.Conv2d(in_channels, out_channels, kernel_size=1, stride=stride)
+		elif down:
+			self.shortcut = nn.AvgPool2d(stride=2, kernel_size=2)
 		else:
 			self.shortcut = nn.Identity()
 	
 	def forward(self, x, t):
-		h = self.conv1(x)
-		h = h + self.time_emb(t)[:, :, None, None]
-		h = self.conv2(h)
+		emb = self.time_emb(t).view(-1, self.conv1.out_channels, 1, 1)
+		h = self.conv1(F.silu(self.norm1(x))) + emb
+		h = self.conv2(self.dropout(F.silu(self.norm2(h))))
 		return self.shortcut(x) + self.residual_scale * h
 
 class Upsample(nn.Module):
@@ -73,25 +73,13 @@ class Upsample(nn.Module):
         super().__init__()
         self.use_conv = use_conv
         if use_conv:
-            self.conv = nn.Conv2d(channels, channels, kernel_size=3, padding=1)
+            # learned 2x upsampling in one kernel, no nearest-neighbour intermediate
+            self.conv = nn.ConvTranspose2d(channels, channels, kernel_size=4, stride=2, padding=1)
 
     def forward(self, x):
-        x = F.interpolate(x, scale_factor=2, mode="nearest")
         if self.use_conv:
-            x = self.conv(x)
-        return x
-
-class Downsample(nn.Module):
-    def __init__(self, channels, use_conv):
-        super().__init__()
-        self.use_conv = use_conv
-        if use_conv:
-            self.op = nn.Conv2d(channels, channels, kernel_size=3, stride=2, padding=1)
-        else:
-            self.op = nn.AvgPool2d(stride=2, kernel_size=2)
-
-    def forward(self, x):
-        return self.op(x)
+            return self.conv(x)
+        return F.interpolate(x, scale_factor=2, mode="nearest")
 
 # -------------------------
 # New Attention Blocks
@@ -105,6 +93,7 @@ class AttentionBlock(nn.Module):
 		self.num_heads = num_heads
 		assert channels % num_heads == 0
 		self.head_dim = channels // num_heads
+		self.scale = self.head_dim ** -0.5  # fixed by the config, constant under torch.compile
 		
 		# Normalization and projection for image tokens
 		self.norm = nn.LayerNorm(channels)
@@ -118,18 +107,13 @@ class AttentionBlock(nn.Module):
 		
 		# Self-attention on image tokens
 		qkv = self.to_qkv(self.norm(img_tokens))
-		q, k, v = qkv.chunk(3, dim=2)
 		
-		# Reshape for multi-head attention
-		q = q.view(B, N, self.num_heads, self.head_dim).transpose(1, 2)
-		k = k.view(B, N, self.num_heads, self.head_dim).transpose(1, 2)
-		v = v.view(B, N, self.num_heads, self.head_dim).transpose(1, 2)
+		# Reshape for multi-head attention: one view + permute to [3, B, heads, N, head_dim]
+		q, k, v = qkv.view(B, N, 3, self.num_heads, self.head_dim).permute(2, 0, 3, 1, 4).unbind(0)
 		
-		# Attention
-		scale = 1.0 / math.sqrt(self.head_dim)
-		attn = torch.softmax(torch.matmul(q, k.transpose(-2, -1)) * scale, dim=-1)
-		attn = self.attn_dropout(attn)
-		out = torch.matmul(attn, v)
+		# Attention (fused kernel, dispatches to flash / memory-efficient backends)
+		dropout_p = self.attn_dropout.p if self.training else 0.0
+		out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p, scale=self.scale)
 		
 		# Reshape back
 		out = out.transpose(1, 2).contiguous().view(B, N, C)
@@ -137,72 +121,31 @@ class AttentionBlock(nn.Module):
 		
 		return out + img_tokens
 
-class CrossAttentionBlock(nn.Module):
+class FiLMBlock(nn.Module):
 	"""
-	Cross-attention block where images attend to parameters and masked objectives
+	FiLM conditioning block where images are modulated by parameters and masked objectives.
+	Replaces cross-attention over the one or two context tokens, which amounts to a
+	per-channel broadcast of the context, with a feature-wise scale and shift.
+	The (scale, shift) of all blocks come from one projection in the UNet; this block
+	reads its own slice starting at `offset`.
 	"""
-	def __init__(self, img_channels, param_dim, obj_dim, num_heads=1, dropout=0.1):
+	def __init__(self, img_channels, offset):
 		super().__init__()
-		self.num_heads = num_heads
-		assert img_channels % num_heads == 0
-		self.head_dim = img_channels // num_heads
+		self.channels = img_channels
+		self.offset = offset
 		
-		# Image token normalization and query projection
+		# Image token normalization
 		self.img_norm = nn.LayerNorm(img_channels)
-		self.to_q = nn.Linear(img_channels, img_channels, bias=False)
-		
-		# Parameter and objective projections to match image channels
-		self.param_proj = nn.Linear(param_dim, img_channels)
-		self.obj_proj = nn.Linear(obj_dim, img_channels)
-		
-		# Context normalization and key/value projection
-		self.context_norm = nn.LayerNorm(img_channels)
-		self.to_kv = nn.Linear(img_channels, 2 * img_channels, bias=False)
 		
 		self.out_proj = nn.Linear(img_channels, img_channels)
 	
-		self.attn_dropout = nn.Dropout(dropout)
-	
-	def forward(self, img_tokens, param_tokens, obj_emb=None):
-		B, N_img, C = img_tokens.shape
-		
-		# Query from image tokens
-		q = self.to_q(self.img_norm(img_tokens))
+	def forward(self, img_tokens, film):
+		# Scale and shift of this block: [B, 2C] -> [B, 1, C] each
+		film = film[:, self.offset:self.offset + 2 * self.channels]
+		scale, shift = film.unsqueeze(1).chunk(2, dim=2)
 		
-		# Project parameters to match image channels
-		param_tokens_proj = self.param_proj(param_tokens)  # [B, param_dim] -> [B, C]
-		param_tokens_proj = param_tokens_proj.unsqueeze(1)  # [B, 1, C]
-		
-		# Build context (parameters + optionally objectives)
-		context = param_tokens_proj  # [B, 1, C]
-		
-		if obj_emb is not None:
-			obj_tokens_proj = self.obj_proj(obj_emb).unsqueeze(1)  # [B, 1, C]
-			context = torch.cat([context, obj_tokens_proj], dim=1)  # [B, 2, C]
-		
-		# Key/Value from context
-		kv = self.to_kv(self.context_norm(context))
-		k, v = kv.chunk(2, dim=2)
-		
-		# Expand context to match image sequence length for cross-attention
-		N_context = context.shape[1]
-		k = k.unsqueeze(2).expand(-1, -1, N_img, -1).reshape(B, N_context * N_img, C)
-		v = v.unsqueeze(2).expand(-1, -1, N_img, -1).reshape(B, N_context * N_img, C)
-		
-		# Reshape queries for multi-head attention
-		q = q.view(B, N_img, self.num_heads, self.head_dim).transpose(1, 2)
-		k = k.view(B, N_context * N_img, self.num_heads, self.head_dim).transpose(1, 2)
-		v = v.view(B, N_context * N_img, self.num_heads, self.head_dim).transpose(1, 2)
-		
-		# Cross-attention
-		scale = 1.0 / math.sqrt(self.head_dim)
-		attn = torch.softmax(torch.matmul(q, k.transpose(-2, -1)) * scale, dim=-1)
-		attn = self.attn_dropout(attn)
-		out = torch.matmul(attn, v)
-		
-		# Reshape back
-		out = out.transpose(1, 2).contiguous().view(B, N_img, C)
-		out = self.out_proj(out)
+		h = self.img_norm(img_tokens) * (1 + scale) + shift
+		out = self.out_proj(h)
 		
 		return out + img_tokens
 
@@ -250,7 +193,8 @@ class ObjectiveEncoder(nn.Module):
 		time_e = self.time_embed(time_emb)
 		h = h + time_e
 		for layer in self.layers:
-			h = layer(h) + self.residual_scale*h
+			# scaled residual in one kernel: layer(h) + residual_scale * h
+			h = torch.add(layer(h), h, alpha=self.residual_scale)
 		h = self.out_proj(h)
 	
 		null_emb = self.null_embedding.unsqueeze(0).expand(batch_size, -1)
@@ -282,40 +226,44 @@ class ParameterEncoder(nn.Module):
 		time_e = self.time_embed(time_emb)
 		h = h + time_e
 		for layer in self.layers:
-			h = layer(h) + self.residual_scale*h
+			# scaled residual in one kernel: layer(h) + residual_scale * h
+			h = torch.add(layer(h), h, alpha=self.residual_scale)
 		return self.out_proj(h)
 
 # -------------------------
-# Sequential container that forwards params and obj_emb
+# Sequential container that forwards FiLM conditioning
 # -------------------------
 class TimestepEmbedSequentialWithObjective(nn.Sequential, TimestepBlock):
     """
-    Sequential container that routes timestep embedding, params and obj_emb.
+    Sequential container that routes timestep embedding and the FiLM (scale, shift)
+    projected from params and obj_emb.
     """
-    def forward(self, x, emb, params=None, obj_emb=None):
+    def forward(self, x, emb, film=None):
+        # Consecutive attention/FiLM layers share one image -> token conversion
+        img_tokens = None
         for layer in self:
-            if isinstance(layer, AttentionBlock):
-                # Convert image to tokens and apply self-attention
-                B, C, H, W = x.shape
-                img_tokens = x.reshape(B, C, H*W).permute(0, 2, 1)
-                img_tokens = layer(img_tokens)
-                x = img_tokens.permute(0, 2, 1).reshape(B, C, H, W)
-            elif isinstance(layer, CrossAttentionBlock):
-                # Convert image to tokens and apply cross-attention
-                B, C, H, W = x.shape
-                img_tokens = x.reshape(B, C, H*W).permute(0, 2, 1)
-                if params is not None:
-                    img_tokens = layer(img_tokens, params, obj_emb)
+            if isinstance(layer, (AttentionBlock, FiLMBlock)):
+                if img_tokens is None:
+                    # Convert image to tokens [B, H*W, C] (a free view for channels-last images)
+                    B, C, H, W = x.shape
+                    img_tokens = x.permute(0, 2, 3, 1).reshape(B, H*W, C)
+                if isinstance(layer, AttentionBlock):
+                    img_tokens = layer(img_tokens)
                 else:
-                    # fallback: zero param vector matching device and batch
-                    zero_params = torch.zeros(x.shape[0], layer.param_dim, device=x.device)
-                    img_tokens = layer(img_tokens, zero_params, obj_emb)
-                x = img_tokens.permute(0, 2, 1).reshape(B, C, H, W)
-            elif isinstance(layer, TimestepBlock):
+                    img_tokens = layer(img_tokens, film)
+                continue
+
+            if img_tokens is not None:
+                x = img_tokens.reshape(B, H, W, C).permute(0, 3, 1, 2)
+                img_tokens = None
+            if isinstance(layer, TimestepBlock):
                 x = layer(x, emb)
             else:
                 x = layer(x)
-        return x, params
+
+        if img_tokens is not None:
+            x = img_tokens.reshape(B, H, W, C).permute(0, 3, 1, 2)
+        return x
 
 # -------------------------
 # UNet definition (patched)
@@ -356,6 +304,8 @@ class UNet(nn.Module):
         self.use_objective_conditioning = use_objective_conditioning
 
         # time embedding
+        assert model_channels % 2 == 0
+        self.register_buffer("freqs", timestep_frequencies(model_channels), persistent=False)
         time_embed_dim = model_channels * 4
         self.time_embed = nn.Sequential(
             nn.Linear(model_channels, time_embed_dim),
@@ -370,30 +320,29 @@ class UNet(nn.Module):
             out_dim=param_hidden_dim,
             time_dim=time_embed_dim
         )
-
-        # Objective encoder for classifier-free guidance
-        if self.use_objective_conditioning:
-            self.objective_encoder = ObjectiveEncoder(
-                obj_dim=obj_dim,
-                hidden_dim=obj_hidden_dim,
-                out_dim=obj_hidden_dim,
-                time_dim=time_embed_dim
-            )
+        # Total width of the (scale, shift) pairs of all FiLM blocks, grown as they are built
+        film_dim = 0
 
         # down blocks
         self.down_blocks = nn.ModuleList([
             TimestepEmbedSequentialWithObjective(nn.Conv2d(in_channels, model_channels, kernel_size=3, padding=1))
         ])
         down_block_chans = [model_channels]
+        # number of skip connections each down block feeds to the up path
+        self.down_block_skips = [1]
         ch = model_channels
         ds = 1
         
         for level, mult in enumerate(channel_mult):
-            for _ in range(num_res_blocks):
+            for i in range(num_res_blocks):
                 layers = []
                 
-                # First residual block
-                layers.append(ResidualBlock(ch, mult * model_channels, time_embed_dim, dropout))
+                # First residual block, strided at the start of every level but the first
+                # (folds the downsampling into its conv1 instead of a separate Downsample)
+                down = level > 0 and i == 0
+                if down:
+                    ds *= 2
+                layers.append(ResidualBlock(ch, mult * model_channels, time_embed_dim, dropout, down=down))
                 ch = mult * model_channels
                 
                 # Second residual block
@@ -403,28 +352,29 @@ class UNet(nn.Module):
                     # Self-attention for images
                     layers.append(AttentionBlock(ch, num_heads, dropout))
 
-                    # Cross-attention between images and parameters/objectives
+                    # FiLM conditioning of images on parameters/objectives
                     if self.use_cross_attention:
-                        layers.append(CrossAttentionBlock(ch, param_hidden_dim, obj_hidden_dim, num_heads, dropout))
+                        layers.append(FiLMBlock(ch, film_dim))
+                        film_dim += 2 * ch
 
                 self.down_blocks.append(TimestepEmbedSequentialWithObjective(*layers))
-                down_block_chans.append(ch)
-                
-            if level != len(channel_mult) - 1:
-                self.down_blocks.append(TimestepEmbedSequentialWithObjective(Downsample(ch, conv_resample)))
-                down_block_chans.append(ch)
-                ds *= 2
+                # the strided block also stands in for the former Downsample skip,
+                # which keeps num_res_blocks + 1 up blocks per level
+                n_skips = 2 if down else 1
+                down_block_chans.extend([ch] * n_skips)
+                self.down_block_skips.append(n_skips)
 
-        # middle block - following the same Residual->Residual->SelfAttn->CrossAttn pattern
+        # middle block - following the same Residual->Residual->SelfAttn->FiLM pattern
         middle_layers = [
             ResidualBlock(ch, ch, time_embed_dim, dropout),
             ResidualBlock(ch, ch, time_embed_dim, dropout),
             AttentionBlock(ch, num_heads, dropout)
         ]
 
-        # Add cross-attention block at bottleneck
+        # Add FiLM conditioning block at bottleneck
         if self.use_cross_attention:
-            middle_layers.append(CrossAttentionBlock(ch, param_hidden_dim, obj_hidden_dim, num_heads, dropout))
+            middle_layers.append(FiLMBlock(ch, film_dim))
+            film_dim += 2 * ch
 
         self.middle_block = TimestepEmbedSequentialWithObjective(*middle_layers)
 
@@ -450,23 +400,47 @@ class UNet(nn.Module):
                     # Self-attention for images
                     layers.append(AttentionBlock(ch, num_heads, dropout))
 
-                    # Cross-attention between images and parameters/objectives
+                    # FiLM conditioning of images on parameters/objectives
                     if self.use_cross_attention:
-                        layers.append(CrossAttentionBlock(ch, param_hidden_dim, obj_hidden_dim, num_heads=num_heads))
+                        layers.append(FiLMBlock(ch, film_dim))
+                        film_dim += 2 * ch
 
                 if level and i == num_res_blocks:
                     layers.append(Upsample(ch, conv_resample))
                     ds //= 2
                 self.up_blocks.append(TimestepEmbedSequentialWithObjective(*layers))
 
-        # Output projections
-        self.img_out = nn.Sequential(
-            norm_layer(ch),
-            nn.SiLU(),
-            nn.Conv2d(model_channels, out_channels, kernel_size=3, padding=1),
-        )
+        # Output projections (norm -> silu -> conv called explicitly in forward)
+        self.img_out_norm = norm_layer(ch)
+        self.img_out = nn.Conv2d(model_channels, out_channels, kernel_size=3, padding=1)
         self.param_out = nn.Linear(param_hidden_dim, param_dim)
 
+        # FiLM conditioning inputs, only built when some block consumes them so that
+        # every parameter feeds the loss (required by DDP without find_unused_parameters)
+        self.film_dim = film_dim
+        if film_dim:
+            # Shared normalization and one wide projection to every FiLM block's (scale, shift)
+            self.param_norm = nn.LayerNorm(param_hidden_dim)
+            self.param_film = nn.Linear(param_hidden_dim, film_dim)
+
+            # Objective encoder for classifier-free guidance
+            if self.use_objective_conditioning:
+                self.objective_encoder = ObjectiveEncoder(
+                    obj_dim=obj_dim,
+                    hidden_dim=obj_hidden_dim,
+                    out_dim=obj_hidden_dim,
+                    time_dim=time_embed_dim
+                )
+                self.obj_norm = nn.LayerNorm(obj_hidden_dim)
+                self.obj_film = nn.Linear(obj_hidden_dim, film_dim)
+
+    def _time_emb(self, timesteps):
+        """
+        Sinusoidal timestep embeddings using the cached frequencies.
+        """
+        args = timesteps[:, None].float() * self.freqs[None]
+        return torch.cat([torch.cos(args), torch.sin(args)], dim=-1)
+
     def forward(self, x, params, timesteps, objectives=None, cfg_mask=None):
         """
         :param x: [N, C, H, W] - input images
@@ -479,30 +453,33 @@ class UNet(nn.Module):
         hs = []
 
         # Time embedding
-        emb = self.time_embed(timestep_embedding(timesteps, self.model_channels))
+        emb = self.time_embed(self._time_emb(timesteps))
 
         # Process parameters
         param_features = self.param_encoder(params, emb)  # [B, param_hidden_dim]
 
-        # Process objectives
-        obj_emb = None
-        if self.use_objective_conditioning and objectives is not None:
-            obj_emb = self.objective_encoder(objectives, emb, cfg_mask)
+        # FiLM (scale, shift) of all blocks from parameters (+ optionally objectives)
+        film = None
+        if self.film_dim:
+            film = self.param_film(self.param_norm(param_features))  # [B, film_dim]
+            if self.use_objective_conditioning and objectives is not None:
+                obj_emb = self.objective_encoder(objectives, emb, cfg_mask)
+                film = film + self.obj_film(self.obj_norm(obj_emb))
 
         # Down stage
         h = x
-        for module in self.down_blocks:
-            h, param_features = module(h, emb, param_features, obj_emb)
-            hs.append(h * 0.1) # scale down skip connections
+        for module, n_skips in zip(self.down_blocks, self.down_block_skips):
+            h = module(h, emb, film)
+            hs.extend([h * 0.1] * n_skips) # scale down skip connections
 
         # Middle
-        h, param_features = self.middle_block(h, emb, param_features, obj_emb)
+        h = self.middle_block(h, emb, film)
 
         # Up stage
         for module in self.up_blocks:
             cat_in = torch.cat([h, hs.pop()], dim=1)
-            h, param_features = module(cat_in, emb, param_features, obj_emb)
+            h = module(cat_in, emb, film)
 
-        img_out = self.img_out(h)
+        img_out = self.img_out(F.silu(self.img_out_norm(h)))
         param_out = self.param_out(param_features)
         return img_out, param_out
\ No newline at end of file
@@ -1,5 +1,4 @@
 # UNetPredictor.py
-import math
 import torch
 from torch import nn
 from torch.nn import functional as F
@@ -62,6 +61,7 @@ class AttentionBlock(nn.Module):
 		self.num_heads = num_heads
 		assert channels % num_heads == 0
 		self.head_dim = channels // num_heads
+		self.scale = self.head_dim ** -0.5  # fixed by the config, constant under torch.compile
 		self.attn_dropout = nn.Dropout(dropout)
 		
 		# Normalization and projection for image tokens
@@ -74,18 +74,13 @@ class AttentionBlock(nn.Module):
 		
 		# Self-attention on image tokens
 		qkv = self.to_qkv(self.norm(img_tokens))
-		q, k, v = qkv.chunk(3, dim=2)
 		
-		# Reshape for multi-head attention
-		q = q.view(B, N, self.num_heads, self.head_dim).transpose(1, 2)
-		k = k.view(B, N, self.num_heads, self.head_dim).transpose(1, 2)
-		v = v.view(B, N, self.num_heads, self.head_dim).transpose(1, 2)
+		# Reshape for multi-head attention: one view + permute to [3, B, heads, N, head_dim]
+		q, k, v = qkv.view(B, N, 3, self.num_heads, self.head_dim).permute(2, 0, 3, 1, 4).unbind(0)
 		
-		# Attention
-		scale = 1.0 / math.sqrt(self.head_dim)
-		attn = torch.softmax(torch.matmul(q, k.transpose(-2, -1)) * scale, dim=-1)
-		attn = self.attn_dropout(attn)
-		out = torch.matmul(attn, v)
+		# Attention (fused kernel, dispatches to flash / memory-efficient backends)
+		dropout_p = self.attn_dropout.p if self.training else 0.0
+		out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p, scale=self.scale)
 		
 		# Reshape back
 		out = out.transpose(1, 2).contiguous().view(B, N, C)
@@ -103,6 +98,7 @@ class CrossAttentionBlock(nn.Module):
 		self.param_dim = param_dim
 		assert img_channels % num_heads == 0
 		self.head_dim = img_channels // num_heads
+		self.scale = self.head_dim ** -0.5  # fixed by the config, constant under torch.compile
 		self.attn_dropout = nn.Dropout(dropout)
 		
 		# Image token normalization and query projection
@@ -135,21 +131,16 @@ class CrossAttentionBlock(nn.Module):
 		kv = self.to_kv(self.context_norm(context))
 		k, v = kv.chunk(2, dim=2)
 		
-		# Expand context to match image sequence length for cross-attention
+		# Reshape for multi-head attention. Context tokens are attended directly:
+		# repeating each of them N_img times leaves the softmax weights unchanged.
 		N_context = context.shape[1]
-		k = k.unsqueeze(2).expand(-1, -1, N_img, -1).reshape(B, N_context * N_img, C)
-		v = v.unsqueeze(2).expand(-1, -1, N_img, -1).reshape(B, N_context * N_img, C)
-		
-		# Reshape queries for multi-head attention
 		q = q.view(B, N_img, self.num_heads, self.head_dim).transpose(1, 2)
-		k = k.view(B, N_context * N_img, self.num_heads, self.head_dim).transpose(1, 2)
-		v = v.view(B, N_context * N_img, self.num_heads, self.head_dim).transpose(1, 2)
+		k = k.view(B, N_context, self.num_heads, self.head_dim).transpose(1, 2)
+		v = v.view(B, N_context, self.num_heads, self.head_dim).transpose(1, 2)
 		
 		# Cross-attention
-		scale = 1.0 / math.sqrt(self.head_dim)
-		attn = torch.softmax(torch.matmul(q, k.transpose(-2, -1)) * scale, dim=-1)
-		attn = self.attn_dropout(attn)
-		out = torch.matmul(attn, v)
+		dropout_p = self.attn_dropout.p if self.training else 0.0
+		out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p, scale=self.scale)
 		
 		# Reshape back
 		out = out.transpose(1, 2).contiguous().view(B, N_img, C)
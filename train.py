@@ -1,5 +1,7 @@
 from pathlib import Path
+import os
 import sys
+import threading
 sys.path.append('.')
 
 from dataset import create_dataset
@@ -8,6 +10,8 @@ from utils.engine import GaussianDiffusionTrainer
 from utils.tools import train_one_epoch, load_yaml
 
 import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel as DDP
 from utils.callbacks import ModelCheckpoint
 
 import joblib
@@ -16,20 +20,36 @@ import joblib
 def train(config):
 	consume = config["consume"]
 	if consume:
-		cp = torch.load(config["consume_path"])
+		cp = torch.load(config["consume_path"], map_location="cpu")
 		config = cp["config"]
-	print(config)
 	
-	device = torch.device(config["device"])
-	loader, param_scaler, prop_scaler = create_dataset(**config["Dataset"])
+	# launched with torchrun: one process per GPU, data parallel over ranks
+	distributed = "LOCAL_RANK" in os.environ
+	if distributed:
+		dist.init_process_group("nccl")
+		local_rank = int(os.environ["LOCAL_RANK"])
+		torch.cuda.set_device(local_rank)
+		device = torch.device("cuda", local_rank)
+	else:
+		device = torch.device(config["device"])
+	is_main = not distributed or dist.get_rank() == 0
+	if is_main:
+		print(config)
+	
+	loader, param_scaler, prop_scaler = create_dataset(**config["Dataset"], distributed=distributed)
 	start_epoch = 1
 
-	joblib.dump(param_scaler, 'checkpoint/param_scaler.pkl')
-	joblib.dump(prop_scaler, 'checkpoint/prop_scaler.pkl')
+	if is_main:
+		# scalers are only read back at generation time, write them off the main thread
+		threading.Thread(target=joblib.dump, args=(param_scaler, 'checkpoint/param_scaler.pkl')).start()
+		threading.Thread(target=joblib.dump, args=(prop_scaler, 'checkpoint/prop_scaler.pkl')).start()
 	
 	model = UNet(**config["Model"]).to(device)
-	optimizer = torch.optim.AdamW(model.parameters(), lr=config["lr"], weight_decay=1e-4)
-	trainer = GaussianDiffusionTrainer(model, **config["Trainer"]).to(device)
+	memory_format = torch.channels_last if config.get("channels_last", False) else torch.contiguous_format
+	model = model.to(memory_format=memory_format)
+	# fused single-kernel update on CUDA, None keeps torch's default (foreach) choice elsewhere
+	optimizer = torch.optim.AdamW(model.parameters(), lr=config["lr"], weight_decay=1e-4,
+								  fused=True if device.type == "cuda" else None)
 	
 	model_checkpoint = ModelCheckpoint(**config["Callback"])
 	
@@ -39,13 +59,32 @@ def train(config):
 		model_checkpoint.load_state_dict(cp["model_checkpoint"])
 		start_epoch = cp["start_epoch"] + 1
 	
+	# DDP/compiled wrappers share parameters with `model`, checkpoints keep using the plain state dict
+	net = model
+	if distributed:
+		net = DDP(net, device_ids=[local_rank], gradient_as_bucket_view=True)
+	if config.get("compile", False):
+		import torch._inductor.config as inductor_config
+		inductor_config.conv_1x1_as_mm = True
+		net = torch.compile(net, mode="reduce-overhead", fullgraph=False, dynamic=False)
+	trainer = GaussianDiffusionTrainer(net, **config["Trainer"]).to(device)
+	
 	for epoch in range(start_epoch, config["epochs"] + 1):
-		loss = train_one_epoch(trainer, loader, optimizer, device, epoch)
-		model_checkpoint.step(loss, model=model.state_dict(), config=config,
-							  optimizer=optimizer.state_dict(), start_epoch=epoch,
-							  model_checkpoint=model_checkpoint.state_dict())
+		if distributed:
+			loader.sampler.set_epoch(epoch)
+		loss = train_one_epoch(trainer, loader, optimizer, device, epoch, amp=config.get("amp", False),
+							   memory_format=memory_format, accum_steps=config.get("accum_steps", 1))
+		if is_main:
+			model_checkpoint.step(loss, model=model.state_dict(), config=config,
+								  optimizer=optimizer.state_dict(), start_epoch=epoch,
+								  model_checkpoint=model_checkpoint.state_dict())
+	
+	if distributed:
+		dist.destroy_process_group()
 	
 
 if __name__ == "__main__":
+    # TF32 for the matmuls left in float32
+    torch.set_float32_matmul_precision("high")
     config = load_yaml("config.yml", encoding="utf-8")
     train(config)
\ No newline at end of file
@@ -28,7 +28,8 @@ def train(config):
 	joblib.dump(prop_scaler, 'predictor/prop_scaler.pkl')
 	
 	model = UNetPredictor(**config["ModelPredictor"]).to(device)
-	optimizer = torch.optim.AdamW(model.parameters(), lr=config["lr"], weight_decay=1e-4)
+	optimizer = torch.optim.AdamW(model.parameters(), lr=config["lr"], weight_decay=1e-4,
+								  fused=True if device.type == "cuda" else None)
 	trainer = PropertyPredictionTrainer(model).to(device)
 	
 	model_checkpoint = ModelCheckpoint(**config["CallbackPredictor"])
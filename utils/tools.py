@@ -1,4 +1,5 @@
 from typing import Optional, Union
+import contextlib
 import torch
 from tqdm import tqdm
 from torchvision.utils import make_grid
@@ -15,7 +16,8 @@ def load_yaml(yml_path: Union[Path, str], encoding="utf-8"):
         cfg = yaml.load(f.read(), Loader=yaml.SafeLoader)
         return cfg
 
-def train_one_epoch(trainer, loader, optimizer, device, epoch):
+def train_one_epoch(trainer, loader, optimizer, device, epoch, amp=False,
+					memory_format=torch.contiguous_format, accum_steps=1):
 	"""
 	Train for one epoch with modified data loader that returns images, parameters and property.
 	
@@ -25,24 +27,38 @@ def train_one_epoch(trainer, loader, optimizer, device, epoch):
 		optimizer: optimizer
 		device: device to use
 		epoch: current epoch number
+		amp: run the forward pass and loss under bfloat16 autocast
+		memory_format: memory format of the images fed to the model, e.g. torch.channels_last
+		accum_steps: number of batches to accumulate gradients over per optimizer step
 	"""
 	trainer.train()
 	total_loss, total_num = 0., 0
+	# DDP wrapped model (also reachable through torch.compile) can skip the gradient all-reduce
+	no_sync = getattr(trainer.model, "no_sync", None)
+	optimizer.zero_grad(set_to_none=True)
 	
 	with tqdm(loader, dynamic_ncols=True, colour="#ff924a") as data:
-		for batch in data:
-			optimizer.zero_grad()
-			
+		for step, batch in enumerate(data, 1):
 			images, params, prop = batch
 			
-			x_0 = images.to(device)
-			params_0 = params.to(device)
-			prop_0 = prop.to(device)
+			x_0 = images.to(device, memory_format=memory_format, non_blocking=True)
+			params_0 = params.to(device, non_blocking=True)
+			prop_0 = prop.to(device, non_blocking=True)
 			
-			loss = trainer(x_0, params_0, prop_0)
+			# only sync gradients on the batch that steps the optimizer
+			sync = step % accum_steps == 0 or step == len(loader)
+			# the last window of the epoch may hold fewer than accum_steps batches
+			window_start = (step - 1) // accum_steps * accum_steps
+			window = min(accum_steps, len(loader) - window_start)
+			ctx = no_sync if no_sync is not None and not sync else contextlib.nullcontext
+			with ctx():
+				with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=amp):
+					loss = trainer(x_0, params_0, prop_0)
+				(loss / window).backward()
 			
-			loss.backward()
-			optimizer.step()
+			if sync:
+				optimizer.step()
+				optimizer.zero_grad(set_to_none=True)
 			
 			total_loss += loss.item()
 			total_num += x_0.shape[0]